@@ -1,7 +1,16 @@
 import argparse
-from fastapi import FastAPI
-
-from src.database_config import SessionLocal, init_db, retrieve_data, UserInfo, Address, CreditCardInfo
+import asyncio
+import gzip
+import json
+
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from src.database_config import (SessionLocal, init_db, retrieve_data, retrieve_changes, retrieve_snapshot_page,
+                                 build_snapshot, UserInfo, Address, CreditCardInfo)
+from src.resilience import retrieve_source_health
+from src.scheduler import prune_unregistered_sources, retrieve_schedule
 from src.tasks import update_user_info, update_addresses_info, update_credit_card_info
 
 # Config FastAPI endpoint for retrieving data from the database.
@@ -10,26 +19,107 @@ app = FastAPI()
 init_db()
 db = SessionLocal()
 
+# Drop state of sources, that are not registered anymore
+prune_unregistered_sources(SessionLocal())
+
+# Build the first snapshot right away, so data is served before the first sync finishes
+if retrieve_snapshot_page(SessionLocal()) is None:
+    build_snapshot(SessionLocal())
+
+# How often change stream checks the database for new changes, in seconds.
+CHANGES_POLL_INTERVAL = 2
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Check, whether client accepts gzip according to Accept-Encoding header. Codings with q=0 are not acceptable.
+    :param accept_encoding: Value of Accept-Encoding header.
+    :return: True, if gzipped response can be sent.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
 
 @app.get("/show-data")
-def get_data():
-    users = retrieve_data(db, UserInfo)
-    addresses = retrieve_data(db, Address)
-    credit_cards = retrieve_data(db, CreditCardInfo)
+def get_data(page: int = 1, version: int | None = None, accept_encoding: str = Header(default="")):
+    """
+    Page of denormalized users with their address and credit cards. Served from the snapshot,
+    that is rebuilt after each sync, so no joins are made on request.
+    Clients should pass X-Snapshot-Version of the first page as "version" when reading the next ones.
+    """
+    snapshot = retrieve_snapshot_page(SessionLocal(), page, version)
+    if snapshot is None:
+        if version is not None and retrieve_snapshot_page(SessionLocal(), 1, version) is None:
+            raise HTTPException(status_code=410, detail=f"Data snapshot version {version} is no longer available. "
+                                                        f"Start again from page 1 without version.")
+        raise HTTPException(status_code=404, detail=f"Page {page} of data snapshot not found.")
+
+    # Response depends on Accept-Encoding, so caches must not share it between clients with different encodings
+    headers = {"X-Snapshot-Version": str(snapshot.version), "X-Page-Count": str(snapshot.page_count),
+               "Vary": "Accept-Encoding"}
+
+    # Snapshot is stored gzipped, so most clients get it as is
+    if accepts_gzip(accept_encoding):
+        return Response(content=snapshot.payload, media_type="application/json",
+                        headers={**headers, "Content-Encoding": "gzip"})
+    return Response(content=gzip.decompress(snapshot.payload), media_type="application/json", headers=headers)
+
+
+@app.get("/source-health")
+def get_source_health():
+    """Circuit breaker state and success/failure counters of each source."""
+    return {"sources": retrieve_source_health(SessionLocal())}
+
+
+@app.get("/changes")
+def get_changes(since: int = 0, limit: int = 1000):
+    changes = retrieve_changes(SessionLocal(), since=since, limit=limit)
 
     return {
-        "users": [row for row in users],
-        "addresses": [row for row in addresses],
-        "credit_cards": [row for row in credit_cards]
+        "last_seq": changes[-1]["seq"] if changes else since,
+        "changes": changes
     }
 
 
+@app.get("/changes/stream")
+def stream_changes(since: int = 0, last_event_id: int | None = Header(default=None)):
+    """Server-Sent Events stream of changes. Reconnecting clients continue from Last-Event-ID header."""
+    async def event_stream(last_seq: int):
+        while True:
+            # Database is polled in threadpool, while waiting between polls does not hold any thread
+            changes = await run_in_threadpool(retrieve_changes, SessionLocal(), since=last_seq)
+            for change in changes:
+                last_seq = change["seq"]
+                yield f"id: {last_seq}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            if not changes:
+                # Comment line keeps connection alive through proxies
+                yield ": keep-alive\n\n"
+                await asyncio.sleep(CHANGES_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(last_event_id if last_event_id is not None else since),
+                             media_type="text/event-stream")
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Updating and retrieving data from the database.")
     parser.add_argument('-r', '--retrieve', action="store_true", help="Retrieve all data entries.")
     parser.add_argument('--update-users', action="store_true", help="Update users database with info from API.")
     parser.add_argument('--update-addresses', action="store_true", help="Update addresses database with info from API.")
     parser.add_argument('--update-cards', action="store_true", help="Update credit cards database with info from API.")
+    parser.add_argument('--schedule', action="store_true", help="Show current effective schedule of update tasks.")
 
     args = parser.parse_args()
     init_db()
@@ -55,6 +145,14 @@ if __name__ == '__main__':
         for card in credit_cards_data:
             print(f"{card.id} | {card.card_number} | {card.card_expiry_date} | {card.card_type} | {card.address_id}")
 
+    if args.schedule:
+        print("SOURCE | INTERVAL (MIN) | NEXT RUN (UTC) | LAST RUN (UTC) | LAST CHANGED")
+        for schedule in retrieve_schedule(db):
+            last_run_at = f"{schedule.last_run_at:%Y-%m-%d %H:%M:%S}" if schedule.last_run_at else "-"
+            last_changed = schedule.last_changed if schedule.last_changed is not None else "-"
+            print(f"{schedule.source} | {schedule.interval // 60} | {schedule.next_run_at:%Y-%m-%d %H:%M:%S} | "
+                  f"{last_run_at} | {last_changed}")
+
     if args.update_users:
         update_user_info()
         print("User info updated. Call -r to see updated data")
@@ -66,4 +164,3 @@ if __name__ == '__main__':
     if args.update_addresses:
         update_addresses_info()
         print("Addresses info updated. Call -r to see updated data")
-
@@ -6,18 +6,12 @@ celery_app = Celery(
     backend='rpc://'
 )
 
+# Beat only wakes dispatcher up, which launches syncs that are due according to their adaptive schedule.
+# Bounds of the schedule of each source are declared in src/sources.py.
 celery_app.conf.beat_schedule = {
-    'update_user_info': {
-        'task': 'src.tasks.update_user_info',
-        'schedule': 30 * 60,  # Every 30 minutes
-    },
-    'update_credit_card_info': {
-        'task': 'src.tasks.update_credit_card_info',
-        'schedule': 40 * 60,  # Every 40 minutes
-    },
-    'update_addresses_info': {
-        'task': 'src.tasks.update_user_info',
-        'schedule': 60 * 60,  # Every 60 minutes
+    'dispatch_due_syncs': {
+        'task': 'src.tasks.dispatch_due_syncs',
+        'schedule': 60,  # Every minute
     },
 }
 
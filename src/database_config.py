@@ -1,17 +1,31 @@
-from sqlalchemy import create_engine, MetaData, Column, Integer, String, ForeignKey
+import gzip
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import (create_engine, MetaData, Column, Integer, String, ForeignKey, DateTime, LargeBinary, func,
+                        inspect)
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship, joinedload, ONETOMANY
 from sqlalchemy.orm import Session, sessionmaker
 
 DATABASE_URL = 'sqlite:///./db/database.db'
 
-engine = create_engine(DATABASE_URL)
+# Amount of records of each kind in one page of data snapshot.
+SNAPSHOT_PAGE_SIZE = 100
+
+# Tasks write concurrently, so connections wait for the write lock longer than default 5 seconds.
+engine = create_engine(DATABASE_URL, connect_args={"timeout": 30})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 metadata = MetaData()
 
 Base = declarative_base(metadata=metadata)
 
 
+def utcnow() -> datetime:
+    """Current UTC time without tzinfo, the way SQLite gives it back."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 def init_db():
     """Init db tables"""
     Base.metadata.create_all(bind=engine)
@@ -57,6 +71,80 @@ class CreditCardInfo(Base):
     user = relationship("UserInfo", back_populates="credit_cards", uselist=False)
 
 
+class ChangeLog(Base):
+    """
+    Log of changes made to the other tables. Sequence number only grows (sqlite_autoincrement makes sure
+    that numbers of deleted rows are never reused), so clients can fetch everything after the last seen one.
+    """
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False, index=True)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)
+    data = Column(String)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class SourceSchedule(Base):
+    """
+    Adaptive schedule of sync task. Stored in the database, so it survives beat restarts.
+    """
+    __tablename__ = "source_schedules"
+
+    source = Column(String, primary_key=True)
+    interval = Column(Integer, nullable=False)
+    next_run_at = Column(DateTime, nullable=False)
+    last_run_at = Column(DateTime)
+    last_changed = Column(Integer)
+
+
+class SourceHealth(Base):
+    """
+    State of circuit breaker of external source and its counters.
+    """
+    __tablename__ = "source_health"
+
+    source = Column(String, primary_key=True)
+    state = Column(String, nullable=False)
+    consecutive_failures = Column(Integer, nullable=False)
+    opened_at = Column(DateTime)
+    total_successes = Column(Integer, nullable=False)
+    total_failures = Column(Integer, nullable=False)
+    total_short_circuits = Column(Integer, nullable=False)
+    last_error = Column(String)
+
+
+class SnapshotVersion(Base):
+    """
+    Versions of data snapshot. Taking a new version is the first write of snapshot build,
+    so SQLite gives each build a unique version and makes concurrent builds wait for each other.
+    """
+    __tablename__ = "snapshot_versions"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    version = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class DataSnapshot(Base):
+    """
+    Page of denormalized view of users with their address and credit cards, together with plain addresses
+    and credit cards tables, stored as gzipped JSON.
+    All pages of one build share version. New version is written and older ones are deleted in one transaction,
+    so readers see either complete old snapshot or complete new one. The previous version is kept until the next
+    build, so clients, that page through it, can finish reading it.
+    """
+    __tablename__ = "data_snapshots"
+
+    version = Column(Integer, primary_key=True)
+    page = Column(Integer, primary_key=True)
+    page_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
 # Dependency to get session
 def get_db():
     db = Session(engine)
@@ -77,6 +165,8 @@ def insert_data(db: Session, model: Base, **kwargs):
     try:
         new_record = model(**kwargs)
         db.add(new_record)
+        db.flush()
+        log_change(db, new_record, "insert")
         db.commit()
         db.refresh(new_record)
         return new_record
@@ -107,6 +197,7 @@ def update_record(db: Session, model: Base, column_id: int, **kwargs):
             setattr(old_record, var, value) if value else None
 
         db.add(old_record)
+        log_change(db, old_record, "update")
         db.commit()
         db.refresh(old_record)
         return old_record
@@ -147,7 +238,7 @@ def delete_record(db: Session, model: Base, column_id: int):
         data = db.query(model).filter(model.id == column_id).first()
         if data is None:
             raise Exception(f"Column with id {column_id} not found in {model.__tablename__}")
-        db.delete(data)
+        delete_and_log(db, data)
         db.commit()
 
         return f"Data with id {column_id} successfully deleted from {model.__tablename__}"
@@ -155,3 +246,178 @@ def delete_record(db: Session, model: Base, column_id: int):
         raise e
     finally:
         db.close()
+
+
+def serialize_record(record: Base) -> dict:
+    """
+    Convert record to dict with its column values.
+    :param record: Model instance.
+    :return: Dict with column names as keys.
+    """
+    return {column.name: getattr(record, column.name) for column in record.__table__.columns}
+
+
+def log_change(db: Session, record: Base, operation: str):
+    """
+    Add change of the record to the change log. Is not committed here,
+    so change is saved in the same transaction, as the record itself.
+    :param db: The database Session object.
+    :param record: Inserted, updated or deleted record. Must have id already (flush after insert).
+    :param operation: "insert", "update" or "delete".
+    :return: The change log entry.
+    """
+    change = ChangeLog(entity=record.__tablename__,
+                       entity_id=record.id,
+                       operation=operation,
+                       data=json.dumps(serialize_record(record)) if operation != "delete" else None)
+    db.add(change)
+    return change
+
+
+def delete_and_log(db: Session, record: Base):
+    """
+    Delete record and write deletion to the change log. Records, that reference the deleted one,
+    are detached from it, and those updates are logged too. Is not committed here.
+    :param db: The database Session object.
+    :param record: Record to delete.
+    """
+    for relation in inspect(record).mapper.relationships:
+        if relation.direction is not ONETOMANY:
+            continue
+        for child in getattr(record, relation.key):
+            for column in relation.remote_side:
+                setattr(child, column.key, None)
+            log_change(db, child, "update")
+
+    log_change(db, record, "delete")
+    db.delete(record)
+
+
+def retrieve_changes(db: Session, since: int = 0, limit: int = 1000):
+    """
+    Retrieve changes with sequence number greater than given one.
+    :param db: The database Session object.
+    :param since: Last sequence number, that client has already seen.
+    :param limit: Max amount of changes to return.
+    :return: List of dicts with changes, ordered by sequence number.
+    """
+    try:
+        changes = (db.query(ChangeLog)
+                   .filter(ChangeLog.seq > since)
+                   .order_by(ChangeLog.seq)
+                   .limit(limit)
+                   .all())
+        return [{
+            "seq": change.seq,
+            "entity": change.entity,
+            "entity_id": change.entity_id,
+            "operation": change.operation,
+            "data": json.loads(change.data) if change.data else None,
+            "created_at": change.created_at.isoformat()
+        } for change in changes]
+    except SQLAlchemyError as e:
+        raise e
+    finally:
+        db.close()
+
+
+def retrieve_last_seq(db: Session) -> int:
+    """
+    Retrieve sequence number of the latest change.
+    :param db: The database Session object.
+    :return: Sequence number, 0 if there were no changes yet.
+    """
+    try:
+        return db.query(func.max(ChangeLog.seq)).scalar() or 0
+    except SQLAlchemyError as e:
+        raise e
+    finally:
+        db.close()
+
+
+def build_snapshot(db: Session, page_size: int = SNAPSHOT_PAGE_SIZE) -> int:
+    """
+    Build new data snapshot from users, addresses and credit cards, and replace the current one with it.
+    Each page contains users with their address and credit cards nested in them,
+    and addresses and credit cards as they are stored in their tables.
+    :param db: The database Session object.
+    :param page_size: Amount of records of each kind in one page.
+    :return: Version of the new snapshot.
+    """
+    try:
+        # Write lock of the database is taken here and held until commit, so concurrent builds run one by one,
+        # and each of them reads data committed by the previous ones.
+        snapshot_version = SnapshotVersion()
+        db.add(snapshot_version)
+        db.flush()
+        version = snapshot_version.version
+
+        # Sequence number is read before the data, so changes made meanwhile are not missed by clients
+        # that apply /changes?since=last_seq on top of this snapshot.
+        last_seq = db.query(func.max(ChangeLog.seq)).scalar() or 0
+
+        # Users are loaded with their address and credit cards in one query
+        users = (db.query(UserInfo)
+                 .options(joinedload(UserInfo.address), joinedload(UserInfo.credit_cards))
+                 .order_by(UserInfo.id)
+                 .all())
+        collections = {
+            "users": [{
+                **serialize_record(user),
+                "address": serialize_record(user.address) if user.address else None,
+                "credit_cards": [serialize_record(card) for card in sorted(user.credit_cards, key=lambda c: c.id)]
+            } for user in users],
+            # Plain tables are kept too, so records without owner are not lost,
+            # and changes from the change log can be applied to the snapshot per entity.
+            "addresses": [serialize_record(address) for address in db.query(Address).order_by(Address.id)],
+            "credit_cards": [serialize_record(card) for card in db.query(CreditCardInfo).order_by(CreditCardInfo.id)]
+        }
+
+        page_count = max(1, *(-(-len(rows) // page_size) for rows in collections.values()))
+
+        for page in range(1, page_count + 1):
+            payload = {
+                "version": version,
+                "last_seq": last_seq,
+                "page": page,
+                "page_count": page_count,
+                **{name: rows[(page - 1) * page_size:page * page_size] for name, rows in collections.items()}
+            }
+            db.add(DataSnapshot(version=version,
+                                page=page,
+                                page_count=page_count,
+                                payload=gzip.compress(json.dumps(payload).encode())))
+
+        # Swap snapshots. Previous version is kept, so clients, that are paging through it, can finish.
+        db.query(DataSnapshot).filter(DataSnapshot.version < version - 1).delete()
+        db.query(SnapshotVersion).filter(SnapshotVersion.version < version - 1).delete()
+        db.commit()
+
+        return version
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+
+def retrieve_snapshot_page(db: Session, page: int = 1, version: int = None):
+    """
+    Retrieve page of the data snapshot.
+    :param db: The database Session object.
+    :param page: Number of page, starting from 1.
+    :param version: Version of the snapshot. The latest one, if not given.
+    Clients, that read several pages, should pass version of the first page, so all pages are from one snapshot.
+    :return: DataSnapshot record, or None if there is no such snapshot version or page.
+    """
+    try:
+        if version is None:
+            # Single query, so page always belongs to the latest complete version
+            version = db.query(func.max(DataSnapshot.version)).scalar_subquery()
+        return (db.query(DataSnapshot)
+                .filter(DataSnapshot.version == version, DataSnapshot.page == page)
+                .first())
+    except SQLAlchemyError as e:
+        raise e
+    finally:
+        db.close()
@@ -0,0 +1,228 @@
+# Deadlines, retries and circuit breaker for fetching data from external sources
+import logging
+import random
+import time
+from datetime import timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.database_config import SourceHealth, utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when fetch runs out of its time budget."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when source is skipped because its circuit breaker is open."""
+
+
+class Deadline:
+    """
+    End-to-end time budget of a fetch. All timeouts inside the fetch should be limited by remaining() time,
+    so the fetch as a whole never takes longer than given amount of seconds.
+    """
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left until deadline. Negative, if it has already passed."""
+        return self.expires_at - time.monotonic()
+
+    def timeout(self, timeout: float) -> float:
+        """
+        Limit timeout of a single operation by the remaining time.
+        :param timeout: Timeout, that operation would use without deadline.
+        :return: Timeout in seconds, not greater than remaining time.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.seconds} seconds exceeded.")
+        return min(timeout, remaining)
+
+
+def backoff_delay(attempt: int, base_delay: float = 1, max_delay: float = 30) -> float:
+    """
+    Jittered exponential back-off. Full jitter spreads retries of different workers over time.
+    :param attempt: Number of failed attempt, starting from 0.
+    :param base_delay: Upper bound of the first delay, in seconds. Doubled for every next attempt.
+    :param max_delay: Upper bound of any delay, in seconds.
+    :return: Delay in seconds.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def retry_call(func, attempts: int, deadline: Deadline = None, base_delay: float = 1, max_delay: float = 30):
+    """
+    Call function and retry it on failure with jittered exponential back-off.
+    Does not retry, if there is not enough time left until deadline to wait before the next attempt.
+    :param func: Function without arguments to call.
+    :param attempts: Max number of calls.
+    :param deadline: Deadline of the whole operation.
+    :param base_delay: Back-off before the second attempt, in seconds. Doubled for every next one.
+    :param max_delay: Upper bound of back-off, in seconds.
+    :return: Result of the function.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise e
+
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if deadline is not None and deadline.remaining() <= delay:
+                raise e
+
+            logger.warning("Attempt %s failed: %s. Retrying in %.1f seconds.", attempt + 1, e, delay)
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of external source. State is stored in the database, so it is shared between all workers
+    and can be inspected from outside.
+
+    After "failure_threshold" consecutive failures breaker opens and calls to the source fail right away
+    with CircuitOpenError. After "cooldown" seconds one trial call is let through (half-open state):
+    success closes the breaker, failure opens it again.
+    """
+    def __init__(self, session_factory, source: str, failure_threshold: int = 3, cooldown: int = 15 * 60):
+        self.session_factory = session_factory
+        self.source = source
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def _get_health(self, db) -> SourceHealth:
+        """Get health record of the source, create it if missing."""
+        health = db.get(SourceHealth, self.source)
+        if health is None:
+            health = SourceHealth(source=self.source, state="closed", consecutive_failures=0,
+                                  total_successes=0, total_failures=0, total_short_circuits=0)
+            db.add(health)
+        return health
+
+    def _set_state(self, health: SourceHealth, state: str) -> None:
+        """Change state of the breaker and log transition."""
+        if health.state != state:
+            logger.warning("Circuit breaker of %s: %s -> %s (consecutive failures: %s)",
+                           self.source, health.state, state, health.consecutive_failures)
+            health.state = state
+
+    def before_call(self) -> None:
+        """
+        Check, whether call to the source is allowed.
+        Raises CircuitOpenError, if breaker is open and cooldown has not passed yet.
+        """
+        db = self.session_factory()
+        try:
+            health = self._get_health(db)
+            if health.state != "closed":
+                now = utcnow()
+                if health.opened_at and now - health.opened_at < timedelta(seconds=self.cooldown):
+                    health.total_short_circuits += 1
+                    db.commit()
+                    raise CircuitOpenError(f"Circuit breaker of {self.source} is {health.state}, skipping.")
+
+                # Let one trial call through. Cooldown starts again, so other workers keep skipping meanwhile.
+                health.opened_at = now
+                self._set_state(health, "half_open")
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+    def on_success(self) -> None:
+        """Record successful call. Closes the breaker."""
+        db = self.session_factory()
+        try:
+            health = self._get_health(db)
+            health.consecutive_failures = 0
+            health.total_successes += 1
+            self._set_state(health, "closed")
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+    def on_failure(self, error: Exception) -> None:
+        """Record failed call. Opens the breaker, if there were too many failures in a row."""
+        db = self.session_factory()
+        try:
+            health = self._get_health(db)
+            health.consecutive_failures += 1
+            health.total_failures += 1
+            health.last_error = str(error)[:500]
+            logger.warning("Fetch from %s failed: %s", self.source, error)
+
+            if health.state == "half_open" or health.consecutive_failures >= self.failure_threshold:
+                health.opened_at = utcnow()
+                self._set_state(health, "open")
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+    def call(self, func):
+        """
+        Call function, that fetches data from the source, through the breaker.
+        :param func: Function without arguments.
+        :return: Result of the function.
+        """
+        self.before_call()
+        try:
+            result = func()
+        except Exception as e:
+            self.on_failure(e)
+            raise e
+        self.on_success()
+        return result
+
+    def stream(self, rows):
+        """
+        Consume stream of rows from the source through the breaker.
+        Breaker is checked before the first row and result is recorded once the stream ends or fails.
+        :param rows: Iterable of rows.
+        :return: Generator of the same rows.
+        """
+        self.before_call()
+        try:
+            yield from rows
+        except Exception as e:
+            self.on_failure(e)
+            raise e
+        self.on_success()
+
+
+def retrieve_source_health(db) -> list:
+    """
+    Retrieve circuit breaker state and counters of all sources.
+    :param db: The database Session object.
+    :return: List of dicts with health of each source.
+    """
+    try:
+        return [{
+            "source": health.source,
+            "state": health.state,
+            "consecutive_failures": health.consecutive_failures,
+            "opened_at": health.opened_at.isoformat() if health.opened_at else None,
+            "total_successes": health.total_successes,
+            "total_failures": health.total_failures,
+            "total_short_circuits": health.total_short_circuits,
+            "last_error": health.last_error
+        } for health in db.query(SourceHealth).all()]
+    except SQLAlchemyError as e:
+        raise e
+    finally:
+        db.close()
@@ -0,0 +1,132 @@
+# Adaptive schedule of sync tasks
+from datetime import timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from src.database_config import SourceSchedule, SourceHealth, utcnow
+from src.sources import SOURCES
+
+
+def next_interval(interval: int, changed: int, min_interval: int, max_interval: int) -> int:
+    """
+    Calculate interval until the next sync of the source.
+    If nothing has changed, interval is doubled (exponential back-off), otherwise it is halved.
+    :param interval: Current interval in seconds.
+    :param changed: Number of records, that the last sync has changed.
+    :param min_interval: Lower bound of the interval.
+    :param max_interval: Upper bound of the interval.
+    :return: New interval in seconds.
+    """
+    interval = interval * 2 if changed == 0 else interval // 2
+    return max(min_interval, min(interval, max_interval))
+
+
+def get_source_schedule(db: Session, source: str) -> SourceSchedule:
+    """
+    Get schedule of the source. Creates it with initial interval, if source has never been scheduled.
+    :param db: The database Session object.
+    :param source: Name of the source in SOURCES.
+    :return: SourceSchedule record.
+    """
+    schedule = db.get(SourceSchedule, source)
+    if schedule is None:
+        schedule = SourceSchedule(source=source,
+                                  interval=SOURCES[source].schedule["initial"],
+                                  next_run_at=utcnow())
+        db.add(schedule)
+    return schedule
+
+
+def prune_unregistered_sources(db: Session) -> list:
+    """
+    Remove schedule and circuit breaker state of sources, that are not in the registry anymore
+    (removed or renamed), so they are not shown in schedule and source health.
+    :param db: The database Session object.
+    :return: List with names of removed sources.
+    """
+    try:
+        removed = set()
+        for model in (SourceSchedule, SourceHealth):
+            for record in db.query(model).filter(model.source.not_in(list(SOURCES))).all():
+                removed.add(record.source)
+                db.delete(record)
+        db.commit()
+        return sorted(removed)
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+
+def claim_due_sources(db: Session) -> list:
+    """
+    Find sources, that are due to sync, and move their next run by current interval,
+    so they are not dispatched again while sync is running. Sync itself reschedules the source on finish.
+    :param db: The database Session object.
+    :return: List with names of due sources.
+    """
+    try:
+        schedules = [get_source_schedule(db, source) for source in SOURCES]
+
+        now = utcnow()
+        due = []
+        for schedule in schedules:
+            if schedule.next_run_at <= now:
+                schedule.next_run_at = now + timedelta(seconds=schedule.interval)
+                due.append(schedule.source)
+        db.commit()
+        return due
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+
+def record_sync(db: Session, source: str, changed: int) -> SourceSchedule:
+    """
+    Save result of the sync and adjust interval of the source according to it.
+    :param db: The database Session object.
+    :param source: Name of the source in SOURCES.
+    :param changed: Number of records, that sync has changed.
+    :return: Updated SourceSchedule record.
+    """
+    try:
+        bounds = SOURCES[source].schedule
+        schedule = get_source_schedule(db, source)
+
+        now = utcnow()
+        schedule.interval = next_interval(schedule.interval, changed, bounds["min"], bounds["max"])
+        schedule.last_run_at = now
+        schedule.last_changed = changed
+        schedule.next_run_at = now + timedelta(seconds=schedule.interval)
+
+        db.commit()
+        db.refresh(schedule)
+        return schedule
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+
+def retrieve_schedule(db: Session) -> list:
+    """
+    Retrieve current effective schedule of all sources.
+    :param db: The database Session object.
+    :return: List of SourceSchedule records.
+    """
+    try:
+        schedules = [get_source_schedule(db, source) for source in SOURCES]
+        db.commit()
+        for schedule in schedules:
+            db.refresh(schedule)
+        return schedules
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
@@ -0,0 +1,90 @@
+# Registry of external data sources, that are synced to the database
+from src.database_config import Base, UserInfo, Address, CreditCardInfo
+
+# Kinds of fetchers, that the sync pipeline supports.
+JSON_FETCHER = "json"
+TABLE_FETCHER = "table"
+
+
+class Source:
+    """
+    Declaration of external data source. Every registered source is synced by the same pipeline
+    (fetch -> parse -> diff -> bulk write -> link), see sync_source in src/tasks.py.
+    """
+    def __init__(self, name: str, fetcher: str, link: str, model: Base, fields: dict, schedule: dict,
+                 key: str = "id", link_to: tuple = None):
+        """
+        :param name: Unique name of the source. Scheduler and circuit breaker keep their state under it.
+        :param fetcher: JSON_FETCHER for API, that returns list of objects, or TABLE_FETCHER for paginated HTML table.
+        :param link: Link to the API or the first page of the table.
+        :param model: Model class of the table, that is updated with fetched data.
+        :param fields: Mapping of model columns to fields of fetched rows.
+        :param schedule: Dict with "initial", "min" and "max" interval between syncs, in seconds.
+        :param key: Column, by which fetched rows are matched with existing records. Must be in fields.
+        :param link_to: Optional (foreign key column, model) pair. Records without foreign key are attached
+        to records of that model, which are not taken by any other record yet.
+        """
+        if fetcher not in (JSON_FETCHER, TABLE_FETCHER):
+            raise Exception(f"Unknown fetcher {fetcher} of source {name}.")
+        if key not in fields:
+            raise Exception(f"Key column {key} of source {name} is not in its fields.")
+
+        self.name = name
+        self.fetcher = fetcher
+        self.link = link
+        self.model = model
+        self.fields = fields
+        self.schedule = schedule
+        self.key = key
+        self.link_to = link_to
+
+
+SOURCES = {}
+
+
+def register_source(source: Source) -> Source:
+    """
+    Add source to the registry, so it gets scheduled and synced.
+    :param source: Source declaration.
+    :return: The same source.
+    """
+    if source.name in SOURCES:
+        raise Exception(f"Source {source.name} is already registered.")
+    SOURCES[source.name] = source
+    return source
+
+
+# Define sources here.
+# Since we don't have any practical implementations of relations, for now records are attached randomly
+# (by id in order) using link_to.
+register_source(Source(
+    name="users",
+    fetcher=JSON_FETCHER,
+    link='https://jsonplaceholder.typicode.com/users',
+    model=UserInfo,
+    fields={"id": "id", "name": "name", "email": "email", "phone": "phone"},
+    schedule={"initial": 30 * 60, "min": 5 * 60, "max": 6 * 60 * 60},
+    link_to=("address_id", Address),
+))
+
+register_source(Source(
+    name="credit_cards",
+    fetcher=TABLE_FETCHER,
+    link='https://random-data-api.com/workspaces/89a079f2-eea3-4d05-bd6b-807993438d67/db_tables/'
+         'aba545fc-aa47-4c00-aec0-84088ef9c1f2',
+    model=CreditCardInfo,
+    fields={"id": "id", "card_number": "card_number", "card_expiry_date": "card_expiry_date",
+            "card_type": "card_type"},
+    schedule={"initial": 40 * 60, "min": 5 * 60, "max": 6 * 60 * 60},
+    link_to=("user_id", UserInfo),
+))
+
+register_source(Source(
+    name="addresses",
+    fetcher=TABLE_FETCHER,
+    link='https://random-data-api.com/workspaces/89a079f2-eea3-4d05-bd6b-807993438d67/db_tables/'
+         'ef0466d7-8858-4693-b039-b4ef97fe6c5c',
+    model=Address,
+    fields={"id": "id", "street_address": "street_address", "city": "city", "country": "country"},
+    schedule={"initial": 60 * 60, "min": 10 * 60, "max": 12 * 60 * 60},
+))
@@ -1,210 +1,251 @@
+import logging
+import time
+
 from sqlalchemy.exc import SQLAlchemyError
 
 from src.celery_config import celery_app
 
-from src.web_driver import FirefoxWebDriver
+from src.resilience import CircuitBreaker, CircuitOpenError, Deadline, backoff_delay, retry_call
+from src.scheduler import claim_due_sources, prune_unregistered_sources, record_sync
+from src.sources import SOURCES, JSON_FETCHER, Source
+from src.web_driver import PaginatedTableCrawler, TableCrawlError, fetch_json
 from src.database_config import (SessionLocal,
-                                 retrieve_data,
-                                 UserInfo,
-                                 Address,
-                                 CreditCardInfo)
+                                 build_snapshot,
+                                 delete_and_log,
+                                 log_change)
 
-# Define API links here.
-USER_DATA_LINK = 'https://jsonplaceholder.typicode.com/users'
-CREDIT_CARD_DATA_LINK = 'https://random-data-api.com/workspaces/89a079f2-eea3-4d05-bd6b-807993438d67/db_tables/aba545fc-aa47-4c00-aec0-84088ef9c1f2'
-ADDRESSES_DATA_LINK = 'https://random-data-api.com/workspaces/89a079f2-eea3-4d05-bd6b-807993438d67/db_tables/ef0466d7-8858-4693-b039-b4ef97fe6c5c'
+# Number of web drivers, that fetch pages of one table concurrently.
+CRAWLER_POOL_SIZE = 3
+# How many times crawl is resumed from the last completed page after failure.
+CRAWLER_RESUME_ATTEMPTS = 2
+# How many times JSON API is called before giving up.
+FETCH_ATTEMPTS = 3
+# End-to-end time budget of fetching data from a source, in seconds.
+FETCH_DEADLINE = 5 * 60
+# Celery kills tasks, that run longer than that, so worker slot is released even if something hangs.
+SYNC_SOFT_TIME_LIMIT = FETCH_DEADLINE + 60
+SYNC_TIME_LIMIT = FETCH_DEADLINE + 120
 
+logger = logging.getLogger(__name__)
 
-def get_driver():
-    """Initiate selenium web driver"""
-    web_driver = FirefoxWebDriver(
-        user_data_link=USER_DATA_LINK,
-        credit_card_data_link=CREDIT_CARD_DATA_LINK,
-        addresses_data_link=ADDRESSES_DATA_LINK
-    )
 
-    return web_driver
+def get_circuit_breaker(source: str) -> CircuitBreaker:
+    """Circuit breaker of the source, that keeps its state in the database."""
+    return CircuitBreaker(SessionLocal, source)
 
 
-@celery_app.task
-def update_user_info() -> None:
+def stream_table_rows(table_link: str, deadline: Deadline = None):
     """
-    Celery task that fetches user data and updates the database.
+    Streams rows of paginated HTML table in order.
+    If crawl fails midway, it is resumed from the last completed page after back-off,
+    so rows are never yielded twice.
+    :param table_link: Link to the table.
+    :param deadline: Deadline of the whole crawl.
+    :return: Generator of dicts, one per table row.
     """
-    try:
-        db = SessionLocal()
+    crawler = PaginatedTableCrawler(table_link, pool_size=CRAWLER_POOL_SIZE, deadline=deadline)
+
+    for attempt in range(CRAWLER_RESUME_ATTEMPTS + 1):
+        try:
+            yield from crawler.crawl()
+            return
+        except TableCrawlError as e:
+            delay = backoff_delay(attempt)
+            if attempt == CRAWLER_RESUME_ATTEMPTS or (deadline is not None and deadline.remaining() <= delay):
+                raise e
+            logger.warning("%s Resuming crawl in %.1f seconds.", e, delay)
+            time.sleep(delay)
+
+
+def fetch_rows(source: Source, deadline: Deadline):
+    """
+    Fetch rows of the source with its fetcher. Nothing is fetched until the first row is requested.
+    :param source: Source declaration.
+    :param deadline: Deadline of the whole fetch.
+    :return: Generator of dicts, one per fetched row.
+    """
+    if source.fetcher == JSON_FETCHER:
+        yield from retry_call(lambda: fetch_json(source.link, deadline), attempts=FETCH_ATTEMPTS, deadline=deadline)
+    else:
+        yield from stream_table_rows(source.link, deadline)
+
+
+def parse_rows(source: Source, rows):
+    """
+    Map fields of fetched rows to model columns.
+    :param source: Source declaration.
+    :param rows: Iterable of fetched rows.
+    :return: Generator of dicts with model columns as keys.
+    """
+    for row in rows:
+        yield {column: row[field] for column, field in source.fields.items()}
 
-        web_driver = get_driver()
-
-        # Get data from API and store in dict
-        user_data = web_driver.get_user_data()
-
-        # Load data from database
-        existing_user_data = retrieve_data(db, UserInfo)
-
-        # Check, if id in newly fetched data exists in database.
-        # If so, update it, else create new record.
-        for new_user in user_data:
-            existing_user = next((user for user in existing_user_data if user.id == new_user['id']), None)
-            if existing_user:
-                # Update existing user data
-                try:
-                    existing_user.name = new_user['name']
-                    existing_user.email = new_user['email']
-                    existing_user.phone = new_user['phone']
-                    db.commit()
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    raise e
+
+def sync_records(db, model, rows, key: str = "id") -> int:
+    """
+    Insert new, update changed and delete missing records of the model with parsed rows.
+    Rows are matched with records by key column. New records are written in bulk,
+    and every insert, update and delete is written to the change log in the same transaction.
+    :param db: The database Session object.
+    :param model: Model class corresponding to the table.
+    :param rows: Iterable of dicts with model columns as keys. Each must have key column.
+    Must contain all rows of the source, since records missing from it are deleted.
+    :param key: Column, by which rows are matched with existing records.
+    :return: Number of inserted, updated and deleted records.
+    """
+    existing_records = {getattr(record, key): record for record in db.query(model).all()}
+    new_records = {}
+    seen_keys = set()
+    changed = 0
+
+    try:
+        for row in rows:
+            seen_keys.add(row[key])
+            existing_record = existing_records.get(row[key])
+
+            if existing_record:
+                # Update existing record only if something has changed
+                if all(getattr(existing_record, column) == value for column, value in row.items()):
+                    continue
+                for column, value in row.items():
+                    setattr(existing_record, column, value)
+                log_change(db, existing_record, "update")
+                changed += 1
+            elif row[key] not in new_records:
+                new_records[row[key]] = model(**row)
             else:
-                # Create new user record
-                try:
-                    new_record = UserInfo(**{
-                        "name": new_user["name"],
-                        "email": new_user["email"],
-                        "phone": new_user["phone"]
-                    })
-                    db.add(new_record)
-                    db.commit()
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    raise e
-
-        # Connect users to addresses.
-        # Since we don't have any practical implementations, for now we just attach them randomly (by id in order)
-
-        # Refresh data from the database
-        existing_user_data = retrieve_data(db, UserInfo)
-        existing_addresses_data = retrieve_data(db, Address)
-
-        # Iterate through users and append to each of them such address_id, that doesn't exist in any other user.
-        for user in existing_user_data:
-            if not user.address_id and existing_addresses_data:
-                user.address_id = next((address.id for address in existing_addresses_data if
-                                        address.id != next((user.address_id for user in existing_user_data if
-                                                            user.address_id == address.id), None)),
-                                       None)
-                db.add(user)
+                # Same row appears twice in the fetched data, the latest one wins
+                for column, value in row.items():
+                    setattr(new_records[row[key]], column, value)
+
+        # Getting here means that fetch has completed, since failed or partial crawl raises while iterating rows.
+        # Empty fetch is more likely an upstream glitch, than deletion of everything, so nothing is deleted then.
+        if seen_keys:
+            for record_key, record in existing_records.items():
+                if record_key not in seen_keys:
+                    delete_and_log(db, record)
+                    changed += 1
+
+        # Insert new records at once, ids are needed for the change log
+        db.add_all(new_records.values())
+        db.flush()
+        for new_record in new_records.values():
+            log_change(db, new_record, "insert")
+        changed += len(new_records)
+
         db.commit()
-    except Exception as e:
+    except SQLAlchemyError as e:
         db.rollback()
         raise e
 
-    finally:
-        db.close()
+    return changed
 
 
-@celery_app.task
-def update_credit_card_info() -> None:
+def link_records(db, model, foreign_key: str, target_model) -> int:
     """
-    Celery task that fetches credit card data and updates the database.
+    Attach records without foreign key to records of target model, that are not taken by any other record yet.
+    :param db: The database Session object.
+    :param model: Model class, which records are attached.
+    :param foreign_key: Foreign key column of the model.
+    :param target_model: Model class, to which records are attached.
+    :return: Number of attached records.
     """
     try:
-        db = SessionLocal()
+        records = db.query(model).order_by(model.id).all()
+        taken_ids = {getattr(record, foreign_key) for record in records}
+        free_ids = iter([target.id for target in db.query(target_model).order_by(target_model.id).all()
+                         if target.id not in taken_ids])
+
+        changed = 0
+        for record in records:
+            if getattr(record, foreign_key):
+                continue
+            target_id = next(free_ids, None)
+            if target_id is None:
+                break
+            setattr(record, foreign_key, target_id)
+            log_change(db, record, "update")
+            changed += 1
 
-        web_driver = get_driver()
-
-        # Get data from API and store in dict
-        credit_card_data = web_driver.get_credit_card_data()
-
-        # Load data from database
-        existing_credit_card_data = retrieve_data(db, CreditCardInfo)
-
-        # Check, if id in newly fetched data exists in database.
-        # If so, update it, else create new record.
-        for new_credit_card in credit_card_data.values():
-            existing_credit_card = next((card for card in existing_credit_card_data if
-                                         card.id == new_credit_card['id']),
-                                        None)
-            if existing_credit_card:
-                # Update existing credit card data
-                try:
-                    existing_credit_card.card_number = new_credit_card['card_number']
-                    existing_credit_card.card_expiry_date = new_credit_card['card_expiry_date']
-                    existing_credit_card.card_type = new_credit_card['card_type']
-                    db.commit()
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    raise e
-            else:
-                # Create new credit card data
-                try:
-                    new_record = CreditCardInfo(**new_credit_card)
-                    db.add(new_record)
-                    db.commit()
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    raise e
-
-        # Connect credit cards to users.
-        # Since we don't have any practical implementations, for now we just attach them randomly (by id in order)
-
-        # Refresh data from the database
-        existing_credit_card_data = retrieve_data(db, CreditCardInfo)
-        existing_user_data = retrieve_data(db, UserInfo)
-
-        # Iterate through credit cards and append to each of them such user_id,
-        # that doesn't exist in any other credit card.
-        for card in existing_credit_card_data:
-            if not card.user_id and existing_user_data:
-                card.user_id = next((user.id for user in existing_user_data if
-                                     user.id != next((card.user_id for card in existing_credit_card_data if
-                                                      card.user_id == user.id), None)),
-                                    None)
-                db.add(card)
         db.commit()
-    except Exception as e:
+        return changed
+    except SQLAlchemyError as e:
         db.rollback()
         raise e
 
-    finally:
-        db.close()
 
-
-@celery_app.task()
-def update_addresses_info() -> None:
+@celery_app.task(soft_time_limit=SYNC_SOFT_TIME_LIMIT, time_limit=SYNC_TIME_LIMIT)
+def sync_source(name: str) -> int:
     """
-    Celery task that fetches addresses data and updates the database.
+    Celery task that syncs registered source with the database:
+    fetch -> parse -> diff -> bulk write -> link. Then data snapshot is rebuilt, if anything has changed,
+    and source is rescheduled.
+    :param name: Name of the source in SOURCES.
+    :return: Number of changed records.
     """
+    source = SOURCES[name]
     try:
         db = SessionLocal()
 
-        web_driver = get_driver()
-
-        # Get data from API and store in dict
-        addresses_data = web_driver.get_addresses_data()
-
-        # Load data from database
-        existing_addresses_data = retrieve_data(db, Address)
-
-        # Check, if id in newly fetched data exists in database.
-        # If so, update it, else create new record.
-        for new_address in addresses_data.values():
-            existing_address = next((address for address in existing_addresses_data if address.id == new_address['id']),
-                                    None)
-            if existing_address:
-                # Update existing address data
-                try:
-                    existing_address.street_address = new_address['street_address']
-                    existing_address.city = new_address['city']
-                    existing_address.country = new_address['country']
-                    db.commit()
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    raise e
-            else:
-                # Create new address data
-                try:
-                    new_record = Address(**new_address)
-                    db.add(new_record)
-                    db.commit()
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    raise e
+        rows = get_circuit_breaker(source.name).stream(fetch_rows(source, Deadline(FETCH_DEADLINE)))
+
+        changed = sync_records(db, source.model, parse_rows(source, rows), source.key)
+        if source.link_to:
+            changed += link_records(db, source.model, *source.link_to)
 
+        # Snapshot stays valid, if nothing has changed
+        if changed:
+            build_snapshot(db)
+        record_sync(db, source.name, changed)
+        return changed
+    except CircuitOpenError as e:
+        logger.warning(e)
+        return 0
     except Exception as e:
         db.rollback()
         raise e
 
     finally:
         db.close()
+
+
+@celery_app.task(soft_time_limit=SYNC_SOFT_TIME_LIMIT, time_limit=SYNC_TIME_LIMIT)
+def update_user_info() -> int:
+    """
+    Celery task that fetches user data and updates the database.
+    :return: Number of changed records.
+    """
+    return sync_source("users")
+
+
+@celery_app.task(soft_time_limit=SYNC_SOFT_TIME_LIMIT, time_limit=SYNC_TIME_LIMIT)
+def update_credit_card_info() -> int:
+    """
+    Celery task that fetches credit card data and updates the database.
+    :return: Number of changed records.
+    """
+    return sync_source("credit_cards")
+
+
+@celery_app.task(soft_time_limit=SYNC_SOFT_TIME_LIMIT, time_limit=SYNC_TIME_LIMIT)
+def update_addresses_info() -> int:
+    """
+    Celery task that fetches addresses data and updates the database.
+    :return: Number of changed records.
+    """
+    return sync_source("addresses")
+
+
+@celery_app.task
+def dispatch_due_syncs() -> list:
+    """
+    Celery task, that is launched by beat every minute and sends sync tasks of sources, that are due according to
+    their adaptive schedule.
+    :return: List with names of dispatched sources.
+    """
+    prune_unregistered_sources(SessionLocal())
+    due_sources = claim_due_sources(SessionLocal())
+    for source in due_sources:
+        celery_app.send_task("src.tasks.sync_source", args=[source])
+
+    return due_sources
@@ -1,5 +1,9 @@
 # Selenium web driver file
+import logging
 import requests
+from queue import Queue
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 from io import StringIO
@@ -12,13 +16,46 @@ from selenium.webdriver.firefox.options import Options
 
 from selenium.common.exceptions import NoSuchElementException
 
+from src.resilience import Deadline, retry_call
+
+# Default timeouts in seconds. When deadline is set, they are also limited by its remaining time.
+PAGE_LOAD_TIMEOUT = 30
+REQUEST_TIMEOUT = 15
+
+logger = logging.getLogger(__name__)
+
+
+def page_link(table_link: str, page: int) -> str:
+    """
+    Builds link to specific page of paginated table.
+    :param table_link: Link to the table.
+    :param page: Number of page, starting from 1.
+    :return: Table link with "page" query parameter set.
+    """
+    parsed = urlparse(table_link)
+    query = parse_qs(parsed.query)
+    query['page'] = [str(page)]
+    return urlunparse(parsed._replace(query=urlencode(query, doseq=True)))
+
+
+def fetch_json(link: str, deadline: Deadline = None):
+    """
+    Fetches JSON from API using requests. Browser is not needed for that.
+    :param link: Link to the API.
+    :param deadline: Deadline, that limits request timeout.
+    :return: Decoded JSON.
+    """
+    timeout = deadline.timeout(REQUEST_TIMEOUT) if deadline else REQUEST_TIMEOUT
+    response = requests.get(link, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
 
 class FirefoxWebDriver:
     """
     Selenium web driver driven by Firefox.
-    Makes corresponding API calls to get user data and credit card data.
-    Pass "user_data_link" and "credit_card_data_link" when initializing as kwargs
-    to set links for those APIs.
+    Extracts pages of HTML tables, signing in to random-data-api.com when needed.
+    Pass "deadline" when initializing as kwarg to limit all waits and page loads by its remaining time.
     """
     def __init__(self, **kwargs):
         firefox_options = Options()
@@ -26,101 +63,242 @@ class FirefoxWebDriver:
 
         self.driver = webdriver.Firefox(options=firefox_options)
 
-        self.user_data_link = kwargs.get("user_data_link")
-        self.credit_card_data_link = kwargs.get("credit_card_data_link")
-        self.addresses_data_link = kwargs.get("addresses_data_link")
+        self.deadline = kwargs.get("deadline")
 
-    def _get_table_data(self, table_link: str) -> dict:
+        self._signed_in = False
+
+    def _timeout(self, timeout: float) -> float:
         """
-        Extracts data from HTML tables.
-        :param table_link: Link to a web page that consists table.
-        :return: Dict with extracted data.
+        Limit timeout by the remaining time of the deadline, if it is set.
+        :param timeout: Timeout of a single operation in seconds.
+        :return: Timeout to use.
         """
-        try:
-            # Login to random-data-api.com first
-            if 'random-data-api.com' in table_link:
-                self.driver.get('https://random-data-api.com/developers/sign_in')
-
-                # Proceed if warning of already sign-in not found
-                if not self.driver.find_elements(
-                        By.XPATH, "//div[@class='toast-body' and contains(text(), 'You are already signed in.')]"):
-
-                    # Type in email
-                    email_input = WebDriverWait(self.driver, 10).until(
-                        EC.visibility_of_element_located((By.ID, 'developer_email'))
-                    )
-                    email_input.clear()
-                    email_input.send_keys('testemail@ex.com')
-
-                    # Type in password
-                    password_input = WebDriverWait(self.driver, 10).until(
-                        EC.visibility_of_element_located((By.ID, "developer_password"))
-                    )
-                    password_input.clear()
-                    password_input.send_keys('testpassword')
-
-                    # Wait until the submit button is clickable and click it
-                    submit_button = WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable((By.XPATH, "//input[@value='Go to dashboard']"))
-                    )
-                    submit_button.click()
-
-                    # Wait until 'Log out' button appears to make sure we logged in
-                    WebDriverWait(self.driver, 15).until(
-                        EC.element_to_be_clickable(
-                            (By.XPATH, "//div[@class='toast-body' and contains(text(), 'Signed in successfully.')]"))
-                    )
-
-            self.driver.get(table_link)
-
-            # Extract <table> tag and save it as HTML text.
-            api_response_element = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CLASS_NAME, 'table'))
+        return self.deadline.timeout(timeout) if self.deadline else timeout
+
+    def _wait(self, timeout: float) -> WebDriverWait:
+        """Create WebDriverWait, that does not outlive the deadline."""
+        return WebDriverWait(self.driver, self._timeout(timeout))
+
+    def _open(self, link: str) -> None:
+        """Open page, that has to load before the deadline."""
+        self.driver.set_page_load_timeout(self._timeout(PAGE_LOAD_TIMEOUT))
+        self.driver.get(link)
+
+    def _sign_in(self) -> None:
+        """
+        Logs in to random-data-api.com, so tables in the workspace become accessible.
+        Does nothing, if this driver has already signed in.
+        """
+        if self._signed_in:
+            return
+
+        self._open('https://random-data-api.com/developers/sign_in')
+
+        # Proceed if warning of already sign-in not found
+        if not self.driver.find_elements(
+                By.XPATH, "//div[@class='toast-body' and contains(text(), 'You are already signed in.')]"):
+
+            # Type in email
+            email_input = self._wait(10).until(
+                EC.visibility_of_element_located((By.ID, 'developer_email'))
             )
-            raw_html = api_response_element.get_attribute('outerHTML')
+            email_input.clear()
+            email_input.send_keys('testemail@ex.com')
 
-            # Convert HTML table to dict
-            df = pd.read_html(StringIO(raw_html))[0]
-            final = df.to_dict(orient='index')
+            # Type in password
+            password_input = self._wait(10).until(
+                EC.visibility_of_element_located((By.ID, "developer_password"))
+            )
+            password_input.clear()
+            password_input.send_keys('testpassword')
+
+            # Wait until the submit button is clickable and click it
+            submit_button = self._wait(10).until(
+                EC.element_to_be_clickable((By.XPATH, "//input[@value='Go to dashboard']"))
+            )
+            submit_button.click()
 
-            return final
+            # Wait until 'Log out' button appears to make sure we logged in
+            self._wait(15).until(
+                EC.element_to_be_clickable(
+                    (By.XPATH, "//div[@class='toast-body' and contains(text(), 'Signed in successfully.')]"))
+            )
 
-        except NoSuchElementException:
-            raise Exception("Element with data not found. Please ensure that element "
-                            "Xpath with data on the source page "
-                            "matches path inside the script, where it tries to find it.")
+        self._signed_in = True
 
-    def get_user_data(self) -> dict:
+    def _load_table_html(self, table_link: str) -> str:
+        """
+        Opens page with the table and returns its HTML.
+        :param table_link: Link to a web page that consists table.
+        :return: outerHTML of the first <table> on the page.
         """
-        Extracts user data from corresponding API using requests.
-        :return: Dict with extracted user data
+        # Login to random-data-api.com first
+        if 'random-data-api.com' in table_link:
+            self._sign_in()
+
+        self._open(table_link)
+
+        # Extract <table> tag and save it as HTML text.
+        api_response_element = self._wait(10).until(
+            EC.presence_of_element_located((By.CLASS_NAME, 'table'))
+        )
+        return api_response_element.get_attribute('outerHTML')
+
+    def get_table_page(self, table_link: str, page: int) -> list:
+        """
+        Extracts rows from a single page of paginated HTML table.
+        :param table_link: Link to the first page of the table.
+        :param page: Number of page to extract, starting from 1.
+        :return: List of dicts, one per table row, in the order they appear on the page.
         """
         try:
-            response = requests.get(self.user_data_link)
-            return response.json()
-        except Exception as e:
-            raise e
+            raw_html = self._load_table_html(page_link(table_link, page))
+            df = pd.read_html(StringIO(raw_html))[0]
+            return df.to_dict(orient='records')
+
+        except NoSuchElementException:
+            raise Exception(f"Table not found on page {page} of {table_link}.")
+
+    def get_page_count(self) -> int:
+        """
+        Discovers the number of pages of the table, that is currently opened in the driver.
+        Looks for pagination links (the ones with "page" query parameter) and takes the biggest page number.
+        :return: Number of pages. 1, if table is not paginated.
+        """
+        page_count = 1
+        for link in self.driver.find_elements(By.XPATH, "//a[contains(@href, 'page=')]"):
+            query = parse_qs(urlparse(link.get_attribute('href') or '').query)
+            for value in query.get('page', []):
+                if value.isdigit():
+                    page_count = max(page_count, int(value))
+
+        return page_count
+
+    def close(self) -> None:
+        """Shuts down the browser."""
+        self.driver.quit()
+
+
+class TableCrawlError(Exception):
+    """
+    Raised when page of the table can not be fetched even after retries.
+    Keeps number of the last page, that was completely yielded, so crawl can be resumed from there.
+    """
+    def __init__(self, table_link: str, page: int, last_completed_page: int):
+        self.table_link = table_link
+        self.page = page
+        self.last_completed_page = last_completed_page
+        super().__init__(f"Failed to fetch page {page} of {table_link}. "
+                         f"Last completed page: {last_completed_page}.")
+
+
+class PaginatedTableCrawler:
+    """
+    Crawls HTML table, that is split across several pages.
+    Discovers number of pages, fetches them concurrently using pool of FirefoxWebDriver instances
+    and yields rows in the original order, so they can be consumed as a stream.
 
-    def get_credit_card_data(self) -> dict:
+    Failed pages are retried with jittered exponential back-off. If deadline is given, it limits the whole crawl.
+    If some page still fails, TableCrawlError is raised. Calling crawl() again on the same crawler
+    resumes from the page after the last completed one, so already yielded rows are not repeated.
+    """
+    def __init__(self, table_link: str, pool_size: int = 3, page_retries: int = 2, deadline: Deadline = None,
+                 driver_factory=FirefoxWebDriver):
+        self.table_link = table_link
+        self.pool_size = max(1, pool_size)
+        self.page_retries = page_retries
+        self.deadline = deadline
+        self.driver_factory = driver_factory
+
+        self.page_count = None
+        self.last_completed_page = 0
+
+    def _fetch_page(self, driver: FirefoxWebDriver, page: int) -> list:
         """
-        Extracts credit card from corresponding API.
-        :return: Dict with extracted credit card data.
+        Fetches a single page with given driver. Retries on failure.
+        :param driver: FirefoxWebDriver instance to use.
+        :param page: Number of page to fetch.
+        :return: List of rows from the page.
         """
-        if self.credit_card_data_link:
-            credit_card_dict = self._get_table_data(self.credit_card_data_link)
-        else:
-            raise Exception("Link for credit card data API is not configured.")
+        return retry_call(lambda: driver.get_table_page(self.table_link, page),
+                          attempts=self.page_retries + 1,
+                          deadline=self.deadline)
 
-        return credit_card_dict
+    def _fetch_page_from_pool(self, drivers: Queue, page: int) -> list:
+        """
+        Fetches a single page using any driver from the pool, that is not busy at the moment.
+        :param drivers: Queue with free drivers.
+        :param page: Number of page to fetch.
+        :return: List of rows from the page.
+        """
+        driver = drivers.get()
+        try:
+            return self._fetch_page(driver, page)
+        finally:
+            drivers.put(driver)
 
-    def get_addresses_data(self) -> dict:
+    def crawl(self):
         """
-            Extracts addresses from corresponding API.
-            :return: Dict with extracted addresses data.
-            """
-        if self.addresses_data_link:
-            addresses_dict = self._get_table_data(self.addresses_data_link)
-        else:
-            raise Exception("Link for addresses data API is not configured.")
+        Yields rows of the table page by page, starting after the last completed page.
+        :return: Generator of dicts, one per table row.
+        """
+        first_page = self.last_completed_page + 1
+        if self.page_count is not None and first_page > self.page_count:
+            return
+
+        drivers = Queue()
+        started_drivers = []
+
+        def start_driver():
+            driver = self.driver_factory(deadline=self.deadline)
+            started_drivers.append(driver)
+            drivers.put(driver)
+
+        try:
+            start_driver()
+
+            # First page is fetched right away to discover how many pages there are.
+            try:
+                first_rows = self._fetch_page(started_drivers[0], first_page)
+                if self.page_count is None:
+                    self.page_count = started_drivers[0].get_page_count()
+            except Exception as e:
+                raise TableCrawlError(self.table_link, first_page, self.last_completed_page) from e
+
+            yield from first_rows
+            self.last_completed_page = first_page
+
+            remaining_pages = list(range(first_page + 1, self.page_count + 1))
+            if not remaining_pages:
+                return
+
+            for _ in range(min(self.pool_size, len(remaining_pages)) - 1):
+                start_driver()
+
+            # Keep a limited window of pages in flight, so memory use does not depend on the table size.
+            window = len(started_drivers) * 2
+            with ThreadPoolExecutor(max_workers=len(started_drivers)) as executor:
+                futures = {}
+                next_to_submit = 0
+                try:
+                    for page in remaining_pages:
+                        while next_to_submit < len(remaining_pages) and len(futures) < window:
+                            submit_page = remaining_pages[next_to_submit]
+                            futures[submit_page] = executor.submit(self._fetch_page_from_pool, drivers, submit_page)
+                            next_to_submit += 1
 
-        return addresses_dict
+                        try:
+                            rows = futures.pop(page).result()
+                        except Exception as e:
+                            raise TableCrawlError(self.table_link, page, self.last_completed_page) from e
+                        yield from rows
+                        self.last_completed_page = page
+                finally:
+                    for future in futures.values():
+                        future.cancel()
+        finally:
+            for driver in started_drivers:
+                try:
+                    driver.close()
+                except Exception as e:
+                    logger.warning("Failed to close web driver: %s", e)
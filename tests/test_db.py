@@ -1,3 +1,7 @@
+import gzip
+import json
+import threading
+
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -7,6 +11,11 @@ from src.database_config import (Base,
                                  update_record,
                                  retrieve_data,
                                  delete_record,
+                                 retrieve_changes,
+                                 retrieve_last_seq,
+                                 build_snapshot,
+                                 retrieve_snapshot_page,
+                                 DataSnapshot,
                                  UserInfo,
                                  Address,
                                  CreditCardInfo)
@@ -134,3 +143,134 @@ def test_delete_data(get_test_db):
     assert users_delete_message.startswith("Data with id")
     assert addresses_delete_message.startswith("Data with id")
     assert credit_cards_delete_message.startswith("Data with id")
+
+
+def test_change_log(get_test_db):
+    """This test ensures, that changes are written to the change log and can be retrieved after given sequence number.
+    Previous tests inserted, updated and deleted entries, so change log should contain all of those changes.
+    Credit card is detached from deleted user and address before they are deleted, which is logged as updates."""
+
+    changes = retrieve_changes(get_test_db, since=0)
+
+    assert [(change["entity"], change["operation"]) for change in changes] == [
+        ("users", "insert"),
+        ("addresses", "insert"),
+        ("users", "update"),
+        ("credit_cards", "insert"),
+        ("credit_cards", "update"),
+        ("credit_cards", "update"),
+        ("users", "delete"),
+        ("credit_cards", "update"),
+        ("addresses", "delete"),
+        ("credit_cards", "delete"),
+    ]
+    assert changes[4]["data"]["card_number"] == 9999888877776666
+    assert changes[5]["data"]["user_id"] is None
+    assert changes[-1]["data"] is None
+
+    # Only changes after given sequence number are returned
+    assert retrieve_changes(get_test_db, since=changes[5]["seq"]) == changes[6:]
+    assert retrieve_last_seq(get_test_db) == changes[-1]["seq"]
+
+
+def test_snapshot(get_test_db):
+    """This test ensures, that data snapshot contains users with their address and credit cards,
+    keeps addresses and credit cards without owner, and that new snapshot replaces the previous ones."""
+
+    address_record = insert_data(get_test_db, Address, street_address="Khreshchatyk 1", city="Kyiv", country="Ukraine")
+    user_record = insert_data(get_test_db, UserInfo, name="Ivan Ivanenko", email="ivan@ex.com", phone="0987654321",
+                              address_id=address_record.id)
+    insert_data(get_test_db, CreditCardInfo, card_number=5555666677778888, card_expiry_date="01/30",
+                card_type="Visa", user_id=user_record.id, address_id=address_record.id)
+    insert_data(get_test_db, Address, street_address="Soborna 2", city="Lviv", country="Ukraine")
+
+    first_version = build_snapshot(get_test_db)
+    second_version = build_snapshot(get_test_db, page_size=1)
+
+    snapshot = retrieve_snapshot_page(get_test_db, 1)
+    data = json.loads(gzip.decompress(snapshot.payload))
+
+    assert second_version > first_version
+    assert snapshot.version == second_version
+    assert data["users"][0]["name"] == "Ivan Ivanenko"
+    assert data["users"][0]["address"]["city"] == "Kyiv"
+    assert data["users"][0]["credit_cards"][0]["card_number"] == 5555666677778888
+    assert data["credit_cards"][0]["card_number"] == 5555666677778888
+
+    # Address without owner is on the second page, since page size is 1
+    assert snapshot.page_count == 2
+    second_page = json.loads(gzip.decompress(retrieve_snapshot_page(get_test_db, 2).payload))
+    assert second_page["users"] == []
+    assert second_page["addresses"][0]["city"] == "Lviv"
+
+    # Previous snapshot is kept until the next build, older ones are gone
+    assert retrieve_snapshot_page(get_test_db, 1, first_version) is not None
+    build_snapshot(get_test_db)
+    assert get_test_db.query(DataSnapshot).filter(DataSnapshot.version == first_version).count() == 0
+    assert retrieve_snapshot_page(get_test_db, 1, second_version) is not None
+
+
+def test_snapshot_concurrent_builds():
+    """This test ensures, that snapshots built at the same time get different versions and all of them succeed."""
+
+    versions = []
+    errors = []
+
+    def build():
+        try:
+            versions.append(build_snapshot(TestingSessionLocal(), page_size=1))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(set(versions)) == 4
+    assert retrieve_snapshot_page(TestingSessionLocal(), 1).version == max(versions)
+
+
+def test_snapshot_paging_across_rebuild():
+    """This test ensures, that client, which pages through snapshot while it is rebuilt, still gets all rows
+    of the version it has started with, and gets the actual data after applying changes since its last_seq."""
+
+    engine = create_engine("sqlite://")
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    for city in ["Kyiv", "Lviv", "Odesa", "Dnipro"]:
+        insert_data(SessionLocal(), Address, street_address="Main str. 1", city=city, country="Ukraine")
+
+    def read_page(page, version=None):
+        snapshot = retrieve_snapshot_page(SessionLocal(), page, version)
+        return snapshot.version, json.loads(gzip.decompress(snapshot.payload))
+
+    first_version = build_snapshot(SessionLocal(), page_size=2)
+    version, first_page = read_page(1)
+    assert version == first_version
+
+    # Data changes and snapshot is rebuilt while client is reading
+    delete_record(SessionLocal(), Address, 1)
+    build_snapshot(SessionLocal(), page_size=2)
+
+    _, second_page = read_page(2, version)
+    addresses = {address["id"]: address for address in first_page["addresses"] + second_page["addresses"]}
+    assert sorted(addresses) == [1, 2, 3, 4]
+
+    # Apply changes made after the snapshot was taken
+    for change in retrieve_changes(SessionLocal(), since=first_page["last_seq"]):
+        if change["entity"] != "addresses":
+            continue
+        if change["operation"] == "delete":
+            addresses.pop(change["entity_id"], None)
+        else:
+            addresses[change["entity_id"]] = change["data"]
+
+    assert sorted(addresses) == sorted(address.id for address in retrieve_data(SessionLocal(), Address))
+
+    # Version, that is older than the previous one, is gone
+    build_snapshot(SessionLocal(), page_size=2)
+    assert retrieve_snapshot_page(SessionLocal(), 1, first_version) is None
@@ -0,0 +1,41 @@
+import pytest
+
+from src.web_driver import PaginatedTableCrawler, TableCrawlError
+
+
+class FakeTableDriver:
+    """Stands in for FirefoxWebDriver. Serves 3 pages with 2 rows each, page 2 fails once."""
+    failures = {2: 1}
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get_table_page(self, table_link, page):
+        if FakeTableDriver.failures.get(page):
+            FakeTableDriver.failures[page] -= 1
+            raise Exception("Page failed to load")
+        return [{'id': (page - 1) * 2 + 1}, {'id': (page - 1) * 2 + 2}]
+
+    def get_page_count(self):
+        return 3
+
+    def close(self):
+        pass
+
+
+def test_paginated_crawler_resumes_in_order():
+    """
+    This test ensures, that paginated crawler yields rows of all pages in order,
+    and resumes from the last completed page after failure.
+    """
+    FakeTableDriver.failures = {2: 1}
+    crawler = PaginatedTableCrawler('https://example.com/table', page_retries=0, driver_factory=FakeTableDriver)
+
+    rows = []
+    with pytest.raises(TableCrawlError):
+        for row in crawler.crawl():
+            rows.append(row)
+    assert crawler.last_completed_page == 1
+
+    rows.extend(crawler.crawl())
+    assert [row['id'] for row in rows] == [1, 2, 3, 4, 5, 6]
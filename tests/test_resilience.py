@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database_config import Base
+from src.resilience import Deadline, DeadlineExceeded, CircuitBreaker, CircuitOpenError, retry_call
+
+engine = create_engine("sqlite://")
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_retry_call():
+    """
+    This test ensures, that failed calls are retried, and that retries stop when deadline is exceeded.
+    """
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise Exception("Upstream is down")
+        return "data"
+
+    assert retry_call(flaky, attempts=3, base_delay=0) == "data"
+    assert len(calls) == 3
+
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).timeout(10)
+
+    # Back-off is longer than the time left until deadline, so there is no second attempt
+    calls.clear()
+    with patch('src.resilience.backoff_delay', return_value=10), patch('src.resilience.time.sleep') as sleep:
+        with pytest.raises(Exception, match="Upstream is down"):
+            retry_call(flaky, attempts=3, deadline=Deadline(5))
+    assert len(calls) == 1
+    sleep.assert_not_called()
+
+    # Exceeded deadline is not retried at all
+    calls.clear()
+
+    def out_of_time():
+        calls.append(1)
+        raise DeadlineExceeded("Deadline exceeded")
+
+    with pytest.raises(DeadlineExceeded):
+        retry_call(out_of_time, attempts=3, base_delay=0)
+    assert len(calls) == 1
+
+
+def test_circuit_breaker():
+    """
+    This test ensures, that circuit breaker opens after repeated failures and skips the source while open.
+    """
+    breaker = CircuitBreaker(TestingSessionLocal, "test_source", failure_threshold=2, cooldown=60)
+
+    def failing():
+        raise Exception("Upstream is down")
+
+    for _ in range(2):
+        with pytest.raises(Exception, match="Upstream is down"):
+            breaker.call(failing)
+
+    # Breaker is open now, so source is not called at all
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "data")
+
+    # After cooldown one trial call is allowed, and success closes the breaker
+    breaker.cooldown = 0
+    assert breaker.call(lambda: "data") == "data"
+    assert breaker.call(lambda: "data") == "data"
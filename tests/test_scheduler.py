@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database_config import Base, SourceSchedule, SourceHealth, utcnow
+from src.scheduler import (next_interval, claim_due_sources, record_sync, retrieve_schedule,
+                           prune_unregistered_sources)
+from src.sources import SOURCES
+
+engine = create_engine("sqlite://")
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_next_interval():
+    """
+    This test ensures, that interval is doubled when nothing has changed, halved otherwise,
+    and always stays within configured bounds.
+    """
+    assert next_interval(30 * 60, changed=0, min_interval=5 * 60, max_interval=6 * 60 * 60) == 60 * 60
+    assert next_interval(30 * 60, changed=3, min_interval=5 * 60, max_interval=6 * 60 * 60) == 15 * 60
+
+    assert next_interval(5 * 60 * 60, changed=0, min_interval=5 * 60, max_interval=6 * 60 * 60) == 6 * 60 * 60
+    assert next_interval(6 * 60, changed=10, min_interval=5 * 60, max_interval=6 * 60 * 60) == 5 * 60
+
+
+def test_claim_due_sources():
+    """
+    This test ensures, that due sources are claimed once: their next run is moved forward by the interval,
+    so the next dispatcher run does not send them again.
+    """
+    before = utcnow()
+
+    # All sources are due on the first run
+    assert claim_due_sources(TestingSessionLocal()) == list(SOURCES)
+    assert claim_due_sources(TestingSessionLocal()) == []
+
+    for schedule in retrieve_schedule(TestingSessionLocal()):
+        assert schedule.next_run_at >= before + timedelta(seconds=schedule.interval)
+
+    # Source becomes due again, once its next run has passed
+    db = TestingSessionLocal()
+    db.get(SourceSchedule, "users").next_run_at = utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert claim_due_sources(TestingSessionLocal()) == ["users"]
+
+
+def test_record_sync():
+    """
+    This test ensures, that result of the sync is saved to the database, so new interval survives beat restarts.
+    """
+    initial = SOURCES["addresses"].schedule["initial"]
+
+    record_sync(TestingSessionLocal(), "addresses", changed=0)
+
+    # Read with a new session, like restarted beat would
+    schedule = TestingSessionLocal().get(SourceSchedule, "addresses")
+    assert schedule.interval == initial * 2
+    assert schedule.last_changed == 0
+    assert schedule.next_run_at - schedule.last_run_at == timedelta(seconds=initial * 2)
+
+    record_sync(TestingSessionLocal(), "addresses", changed=5)
+    assert TestingSessionLocal().get(SourceSchedule, "addresses").interval == initial
+
+
+def test_prune_unregistered_sources():
+    """
+    This test ensures, that state of sources, which are not in the registry, is removed, and state of registered ones
+    is kept.
+    """
+    db = TestingSessionLocal()
+    db.add(SourceSchedule(source="update_user_info", interval=60, next_run_at=utcnow()))
+    db.add(SourceHealth(source="update_user_info", state="open", consecutive_failures=3,
+                        total_successes=0, total_failures=3, total_short_circuits=0))
+    db.add(SourceHealth(source="users", state="closed", consecutive_failures=0,
+                        total_successes=1, total_failures=0, total_short_circuits=0))
+    db.commit()
+
+    assert prune_unregistered_sources(TestingSessionLocal()) == ["update_user_info"]
+
+    db = TestingSessionLocal()
+    assert db.get(SourceSchedule, "update_user_info") is None
+    assert db.get(SourceHealth, "update_user_info") is None
+    assert db.get(SourceHealth, "users") is not None
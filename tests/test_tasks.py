@@ -1,7 +1,13 @@
 from unittest.mock import patch
 
-from src.tasks import update_user_info, update_addresses_info, update_credit_card_info
-from src.database_config import retrieve_data, UserInfo, Address, CreditCardInfo
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.tasks import update_user_info, update_addresses_info, update_credit_card_info, sync_source, sync_records
+from src.database_config import (Base, retrieve_data, retrieve_changes, retrieve_snapshot_page,
+                                 UserInfo, Address, CreditCardInfo)
 
 
 def test_fetch_and_refresh(get_test_db):
@@ -23,3 +29,61 @@ def test_fetch_and_refresh(get_test_db):
     assert isinstance(addresses_data[0].id, int)
     assert isinstance(users_data[0].id, int)
     assert isinstance(credit_cards_data[0].id, int)
+
+
+def test_sync_source():
+    """
+    This test ensures, that generic pipeline inserts new records, updates only changed ones,
+    deletes records missing upstream, links records of registered source and writes changes to the change log.
+    """
+    engine = create_engine("sqlite://")
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    db = TestingSessionLocal()
+    db.add(Address(id=1, street_address="Shevchenka str. 25", city="Zhmerynka", country="Ukraine"))
+    db.commit()
+
+    users = [
+        {"id": 1, "name": "John Johnson", "email": "john@ex.com", "phone": "1234567890", "website": "ex.com"},
+        {"id": 2, "name": "Ivan Ivanenko", "email": "ivan@ex.com", "phone": "0987654321", "website": "ex.com"},
+    ]
+
+    with patch('src.tasks.SessionLocal', TestingSessionLocal), patch('src.tasks.fetch_json', return_value=users):
+        # 2 inserts and 1 user attached to the only address
+        assert sync_source("users") == 3
+
+        snapshot_version = retrieve_snapshot_page(TestingSessionLocal()).version
+
+        # Nothing has changed upstream, so snapshot is not rebuilt either
+        assert sync_source("users") == 0
+        assert retrieve_snapshot_page(TestingSessionLocal()).version == snapshot_version
+
+        users[1]["phone"] = "1111111111"
+        assert sync_source("users") == 1
+
+        db = TestingSessionLocal()
+        assert db.get(UserInfo, 1).address_id == 1
+        assert db.get(UserInfo, 2).phone == "1111111111"
+
+        # User removed upstream is deleted, and its address is attached to the other user
+        users.pop(0)
+        assert sync_source("users") == 2
+
+    db = TestingSessionLocal()
+    assert db.get(UserInfo, 1) is None
+    assert db.get(UserInfo, 2).address_id == 1
+    assert [change["operation"] for change in retrieve_changes(db)] == ["insert", "insert", "update", "update",
+                                                                        "delete", "update"]
+
+    # Nothing is deleted, if fetch fails midway
+    def partial_fetch():
+        yield {"id": 3, "name": "Petro Petrenko", "email": "petro@ex.com", "phone": "2222222222"}
+        raise Exception("Upstream is down")
+
+    with pytest.raises(Exception, match="Upstream is down"):
+        sync_records(db, UserInfo, partial_fetch())
+
+    db = TestingSessionLocal()
+    assert db.get(UserInfo, 2) is not None
+    assert db.get(UserInfo, 3) is None